@@ -49,7 +49,7 @@ void decay_he(double t, std::map<int, double>::const_iterator &it, std::map<int,
   }
 }
 
-std::map<int, double> decay(std::map<int, double> comp, double t) {
+std::map<int, double> decay(const std::map<int, double>& comp, double t) {
   // setup
   using std::map;
   int nuc;
@@ -24,7 +24,7 @@ namespace decayers {
 
 extern const int all_nucs[4];
 
-std::map<int, double> decay(std::map<int, double> comp, double t);
+std::map<int, double> decay(const std::map<int, double>& comp, double t);
 
 }  // namespace decayers
 }  // namespace pyne
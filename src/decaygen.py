@@ -5,28 +5,47 @@ It is suppossed to be fast.
 import os
 import io
 import sys
+import math
 import pdb
 import time
+import hashlib
 import shutil
+import textwrap
 import warnings
 import traceback
 import subprocess
+from functools import lru_cache, partial
+from concurrent.futures import ProcessPoolExecutor
 from argparse import ArgumentParser, Namespace
 
 import numpy as np
 warnings.simplefilter('ignore', RuntimeWarning)
 import tables as tb
 import jinja2
+try:
+    # numba is not a hard dependency of decaygen
+    from numba import njit
+except ImportError:
+    njit = None
 
 from pyne.utils import QAWarning, toggle_warnings
 warnings.simplefilter('ignore', QAWarning)
 toggle_warnings()
+from pyne import __version__ as pyne_version
 from pyne import nuc_data
 from pyne import nucname
-from pyne.data import branch_ratio, half_life, decay_const, \
-    decay_children, fpyield
+from pyne import data
+
+# The data lookups are memoized since chain generation revisits the same
+# nuclides and parent-child pairs many times over.
+branch_ratio = lru_cache(maxsize=None)(data.branch_ratio)
+half_life = lru_cache(maxsize=None)(data.half_life)
+decay_const = lru_cache(maxsize=None)(data.decay_const)
+decay_children = lru_cache(maxsize=None)(data.decay_children)
+fpyield = lru_cache(maxsize=None)(data.fpyield)
 
 ENV = jinja2.Environment(undefined=jinja2.StrictUndefined)
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pyne', 'decay-gen')
 
 autogenwarn = """
 // !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
@@ -56,7 +75,7 @@ namespace decayers {
 
 extern const int all_nucs[{{ nucs|length }}];
 
-std::map<int, double> decay(std::map<int, double> comp, double t);
+std::map<int, double> decay(const std::map<int, double>& comp, double t);
 
 }  // namespace decayers
 }  // namespace pyne
@@ -72,7 +91,14 @@ SOURCE = ENV.from_string("""
 // This file was generated with the following command:
 // {{ args }}
 
+// The exponentials in decay() are evaluated in a loop that can use vector
+// math (e.g. glibc's libmvec) when built with flags such as
+//   -O2 -fopenmp-simd -ffast-math -mavx2
+// and is otherwise a plain scalar loop. PyNE's own build compiles this file
+// at -O0, so there it stays scalar.
+
 #include <cmath>
+#include <algorithm>
 #include "decay.h"
 
 #ifdef PYNE_IS_AMALGAMATED
@@ -84,25 +110,56 @@ SOURCE = ENV.from_string("""
 namespace pyne {
 namespace decayers {
 
-{{ funcs }}
-
-std::map<int, double> decay(std::map<int, double> comp, double t) {
+// Stable nuclides j in all_nucs are flagged in STABLE and go straight to out[j].
+// Each other nuclide j owns the exponent coefficients
+// A[A_OFFSET[j]:A_OFFSET[j+1]] and the terms K, B, I[TERM_OFFSET[j]:TERM_OFFSET[j+1]].
+// A term adds (amount of j) * K * exp(A[A_OFFSET[j] + B] * t) to out[I].
+// Minor terms, with |K| < {{ minor_k }} and a total rounding error of at most
+// {{ minor_err }} per nuclide, are stored in single precision instead, in
+// K_MINOR, B_MINOR, I_MINOR[MINOR_OFFSET[j]:MINOR_OFFSET[j+1]]. Their rounding
+// error for each output is added back into its largest K, so outputs are exact
+// at t = 0.
+{{ tables }}
+
+std::map<int, double> decay(const std::map<int, double>& comp, double t) {
   // setup
   using std::map;
-  int nuc;
+  int n;
+  int nexp;
   int i = 0;
+  int j = 0;
+  const int* nuc;
+  const double* a;
+  double e [{{ max_exps }}];
   double out [{{ nucs|length }}] = {};  // init to zero
   map<int, double> outcomp;
 
   // body
   map<int, double>::const_iterator it = comp.begin();
   for (; it != comp.end(); ++it) {
-    switch (nucname::znum(it->first)) {
-      {{ cases|indent(6) }}
-      default:
-        outcomp.insert(*it);
-        break;
+    n = nucname::id_to_state_id(it->first);
+    nuc = std::lower_bound(all_nucs, all_nucs + {{ nucs|length }}, n);
+    if (nuc == all_nucs + {{ nucs|length }} || *nuc != n) {
+      outcomp.insert(outcomp.end(), *it);
+      continue;
+    }
+    j = nuc - all_nucs;
+    if (STABLE[j]) {
+      out[j] += it->second;
+      continue;
     }
+    a = A + A_OFFSET[j];
+    nexp = A_OFFSET[j + 1] - A_OFFSET[j];
+#pragma GCC diagnostic push
+#pragma GCC diagnostic ignored "-Wunknown-pragmas"
+#pragma omp simd
+    for (i = 0; i < nexp; ++i)
+      e[i] = exp(a[i]*t);
+#pragma GCC diagnostic pop
+    for (i = TERM_OFFSET[j]; i < TERM_OFFSET[j + 1]; ++i)
+      out[I[i]] += (it->second) * K[i] * e[B[i]];
+    for (i = MINOR_OFFSET[j]; i < MINOR_OFFSET[j + 1]; ++i)
+      out[I_MINOR[i]] += (it->second) * K_MINOR[i] * e[B_MINOR[i]];
   }
 
   // cleanup
@@ -123,59 +180,84 @@ const int all_nucs [{{ nucs|length }}] = {
 """.strip())
 
 
-ELEM_FUNC = ENV.from_string("""
-void decay_{{ elem|lower }}(double t, std::map<int, double>::const_iterator &it, std::map<int, double> &outcomp, double (&out)[{{ nucs|length }}]) {
-  //using std::exp2;
-  switch (nucname::id_to_state_id(it->first)) {
-    {{ cases|indent(4) }}
-    } default: {
-      outcomp.insert(*it);
-      break;
-    }
-  }
-}
-""".strip())
+# exponent coefficients are -ln(2)/half-life, so that exp() may be used
+LN2 = np.log(2)
+# terms with smaller coefficients than this are stored as floats
+MINOR_K = 1e-6
+# the total rounding error allowed for a nuclide's float terms
+MINOR_ERR = 1e-12
+FLT_TINY = np.finfo(np.float32).tiny
 
 
-# Some strings that need not be redefined
-BREAK = '  break;'
-CHAIN_STMT = '  out[{0}] += {1};'
-CHAIN_EXPR = '(it->second) * ({0})'
-EXP_EXPR = 'exp2({a:.17e}*t)'
-KEXP_EXPR = '{k:.17e}*' + EXP_EXPR
-B_STMT = 'double b{b} = {exp};'
-B_EXPR = 'b{b}'
-KB_EXPR = '{k:.17e}*' + B_EXPR
-
-
-def genfiles(nucs, short=1e-16, small=1e-16, sf=False, dummy=False, debug=False):
+def genfiles(nucs, short=1e-16, small=1e-16, sf=False, dummy=False, debug=False,
+             jobs=None, min_branch=0.0):
+    # decay() binary searches all_nucs
+    nucs = sorted(nucs)
     ctx = Namespace(
         nucs=nucs,
         autogenwarn=autogenwarn,
         dummy_ifdef=('ifdef' if dummy else 'ifndef'),
         args=' '.join(sys.argv)
         )
-    ctx.cases = gencases(nucs, debug=debug)
-    ctx.funcs = genelemfuncs(nucs, short=short, small=small, sf=sf, debug=debug)
+    ctx.minor_k, ctx.minor_err = MINOR_K, MINOR_ERR
+    ctx.tables, ctx.max_exps = gentables(nucs, short=short, small=small, sf=sf,
+                                         debug=debug, jobs=jobs,
+                                         min_branch=min_branch)
     hdr = HEADER.render(ctx.__dict__)
     src = SOURCE.render(ctx.__dict__)
     return hdr, src
 
 
-def genchains(chains, sf=False):
-    chain = chains[-1]
-    children = decay_children(chain[-1])
+def genchildren(nuc, sf=False):
+    """Returns the children that a nuclide's decay chains may continue with."""
+    if decay_const(nuc) == 0:
+        return set()
+    children = decay_children(nuc)
     # filters spontaneous fission
     if not sf:
-        children = {c for c in children if (0.0 == fpyield(chain[-1], c)) and (c not in chain) }
-    if decay_const(chain[-1]) != 0:
-        for child in children:
-            if child not in chain:
-                chains.append(chain + (child,))
-                chains = genchains(chains, sf=sf)
+        children = {c for c in children if 0.0 == fpyield(nuc, c)}
+    return children
+
+
+def genchaingammas(nuc, sf=False, min_branch=0.0):
+    """Returns all decay chains that start from a nuclide and do not revisit a
+    nuclide, as (chain, gamma) tuples where gamma is the product of the branch
+    ratios along the chain. This is an iterative depth-first search that
+    prunes a chain, and all of its extensions, as soon as its gamma is at or
+    below min_branch.
+    """
+    chains = []
+    stack = [((nuc,), 1.0)]
+    while len(stack) > 0:
+        chain, gamma = stack.pop()
+        chains.append((chain, gamma))
+        parent = chain[-1]
+        extensions = []
+        for child in genchildren(parent, sf=sf):
+            if child in chain:
+                continue
+            g = gamma * branch_ratio(parent, child)
+            if g <= min_branch:
+                continue
+            extensions.append((chain + (child,), g))
+        # reversed so that chains come out in depth-first order
+        stack.extend(reversed(extensions))
     return chains
 
 
+def genchains(chains, sf=False):
+    """Returns the chains with the last chain replaced by all of its
+    extensions that do not revisit a nuclide, including those that have a
+    zero branch ratio along the way.
+    """
+    head = chains[-1][:-1]
+    seen = set(head)
+    tails = [head + c for c, _ in genchaingammas(chains[-1][-1], sf=sf,
+                                                 min_branch=-np.inf)
+             if seen.isdisjoint(c)]
+    return chains[:-1] + tails
+
+
 def almost_stable(hl_i, k_i):
     """Tells whether a nuclide is almost stable"""
     return hl_i > 1e16 and (np.isnan(k_i) or np.isinf(k_i))
@@ -299,15 +381,28 @@ def hl_degeneracy(hl, k, a, outerzeros):
     return k, a, t_term
 
 
+def chain_gamma(chain):
+    """Returns the product of the branch ratios along a chain, stopping as
+    soon as it is zero.
+    """
+    gamma = 1.0
+    for p, c in zip(chain[:-1], chain[1:]):
+        gamma *= branch_ratio(p, c)
+        if gamma == 0.0:
+            break
+    return gamma
+
+
 def k_a_from_hl(chain, short=1e-16, small=1e-16):
-    hl = np.array([half_life(n, False) for n in chain])
+    gamma = chain_gamma(chain)
+    if gamma == 0.0 or np.isnan(gamma):
+        return None, None, None
+    hl = np.fromiter((half_life(n, False) for n in chain), dtype=float,
+                     count=len(chain))
     hl = hl[~np.isnan(hl)]
     outerdiff = hl - hl[:, np.newaxis]
     outerzeros = (outerdiff == 0.0)
-    a = -1.0 / hl
-    gamma = np.prod([branch_ratio(p, c) for p, c in zip(chain[:-1], chain[1:])])
-    if gamma == 0.0 or np.isnan(gamma):
-        return None, None, None
+    a = -LN2 / hl
     ends_stable = np.isinf(hl[-1])
     k = k_from_hl_stable(hl, gamma, outerdiff, outerzeros) if ends_stable else \
         k_from_hl_unstable(hl, gamma, outerdiff, outerzeros)
@@ -328,128 +423,376 @@ def k_a_from_hl(chain, short=1e-16, small=1e-16):
     return k[mask], a[mask], t_term[mask]
 
 
-def kbexpr(k, b):
-    if k == 1.0:
-        return B_EXPR.format(b=b)
+def k_from_hl_stable_batch(hl, gamma, outerdiff, outerzeros):
+    """Batched version of k_from_hl_stable() over rows of equal length chains."""
+    C = hl.shape[1]
+    outer = 1 / outerdiff[:, :C-1, :C-1]
+    outer[outerzeros[:, :C-1, :C-1]] = 1.0
+    p = outer.prod(axis=1)
+    k = -gamma[:, np.newaxis] * p * hl[:, :-1]**(C-2)
+    k = np.concatenate([k, gamma[:, np.newaxis]], axis=1)
+    return k
+
+
+def k_from_hl_unstable_batch(hl, gamma, outerdiff, outerzeros):
+    """Batched version of k_from_hl_unstable() over rows of equal length chains."""
+    C = hl.shape[1]
+    outer = 1 / outerdiff
+    outer[outerzeros] = 1.0
+    p = outer.prod(axis=1)
+    T_C = hl[:, -1:]
+    T_i_C = hl**(C - 2)
+    k = (gamma[:, np.newaxis] * T_C) * T_i_C * p
+    return k
+
+
+def k_from_hl_short(hl, gamma, ends_stable):
+    """Closed forms of the batched k values for chains of length two or three,
+    which are the most common ones, without building outer difference arrays.
+    """
+    C = hl.shape[1]
+    if C == 2:
+        d01 = hl[:, 0] - hl[:, 1]
+        k_stable = [-gamma, gamma]
+        k_unstable = [gamma * hl[:, 1] / d01, gamma * hl[:, 1] / -d01]
     else:
-        return KB_EXPR.format(k=k, b=b)
+        d01 = hl[:, 0] - hl[:, 1]
+        d02 = hl[:, 0] - hl[:, 2]
+        d12 = hl[:, 1] - hl[:, 2]
+        k_stable = [-gamma * hl[:, 0] / d01, gamma * hl[:, 1] / d01, gamma]
+        g = gamma * hl[:, 2]
+        k_unstable = [g * hl[:, 0] / (d01 * d02), -g * hl[:, 1] / (d01 * d12),
+                      g * hl[:, 2] / (d02 * d12)]
+    k = np.where(ends_stable[:, np.newaxis], np.stack(k_stable, axis=1),
+                 np.stack(k_unstable, axis=1))
+    return k
+
+
+def k_from_hl_loops(hl, gamma, ends_stable):
+    """Computes the same k values as k_from_hl_stable_batch() and
+    k_from_hl_unstable_batch() with explicit loops. This is what gets
+    JIT compiled when numba is available.
+    """
+    N, C = hl.shape
+    k = np.empty((N, C))
+    for n in range(N):
+        # the end nuclide is ignored if it is stable
+        D = C - 1 if ends_stable[n] else C
+        for j in range(D):
+            p = 1.0
+            for i in range(D):
+                diff = hl[n, j] - hl[n, i]
+                if diff != 0.0:
+                    p *= 1.0 / diff
+            if ends_stable[n]:
+                k[n, j] = -gamma[n] * p * hl[n, j]**(C - 2)
+            else:
+                k[n, j] = (gamma[n] * hl[n, C - 1]) * hl[n, j]**(C - 2) * p
+        if ends_stable[n]:
+            k[n, C - 1] = gamma[n]
+    return k
+
+
+k_from_hl_jit = None if njit is None else njit(cache=True)(k_from_hl_loops)
+
+
+def k_filter_batch(k, small=1e-16):
+    """Batched version of k_filter() for rows without t-terms."""
+    k_not_inf_or_nan = np.isfinite(k)
+    k_abs = np.where(k_not_inf_or_nan, np.abs(k), 0.0)
+    k_max = k_abs.max(axis=1)
+    k_filt = (k_abs / k_max[:, np.newaxis]) > small
+    k_filt = np.bitwise_and(k_filt, k_not_inf_or_nan)
+    return k_filt
+
+
+def k_a_from_hl_batch(chains, short=1e-16, small=1e-16, gammas=None):
+    """Computes the k and a coefficients for many chains at once. Chains of the
+    same length are stacked so that the regular cases are computed in a single
+    pass. Chains with unknown or almost-stable half-lives, or with degenerate
+    half-lives, fall back to k_a_from_hl(). Known branch products may be given
+    as a dict of gammas. Returns a dict mapping each chain of length two or
+    more to its (k, a, t_term) tuple.
+    """
+    kats = {}
+    buckets = {}
+    for chain in chains:
+        if len(chain) < 2:
+            continue
+        gamma = chain_gamma(chain) if gammas is None else gammas[chain]
+        if gamma == 0.0 or np.isnan(gamma):
+            kats[chain] = (None, None, None)
+        else:
+            buckets.setdefault(len(chain), []).append((chain, gamma))
+    for C, bucket in buckets.items():
+        bucket, gamma = zip(*bucket)
+        gamma = np.array(gamma)
+        hl = np.fromiter((half_life(n, False) for chain in bucket for n in chain),
+                         dtype=float, count=len(bucket)*C).reshape(len(bucket), C)
+        a = -LN2 / hl
+        ends_stable = np.isinf(hl[:, -1])
+        if C <= 3:
+            k = k_from_hl_short(hl, gamma, ends_stable)
+        elif k_from_hl_jit is None:
+            outerdiff = hl[:, np.newaxis, :] - hl[:, :, np.newaxis]
+            outerzeros = (outerdiff == 0.0)
+            k = np.empty(hl.shape, dtype=float)
+            for rows, k_from_hl in [(ends_stable, k_from_hl_stable_batch),
+                                    (~ends_stable, k_from_hl_unstable_batch)]:
+                if rows.any():
+                    k[rows] = k_from_hl(hl[rows], gamma[rows], outerdiff[rows],
+                                        outerzeros[rows])
+        else:
+            k = k_from_hl_jit(hl, gamma, ends_stable)
+        irregular = np.isnan(hl).any(axis=1)
+        irregular |= almost_stable_mask(hl, k).any(axis=1)
+        # degenerate half-lives
+        irregular |= (np.diff(np.sort(hl, axis=1), axis=1) == 0.0).any(axis=1)
+        mask = k_filter_batch(k, small=small)
+        null = (mask.sum(axis=1) == 0)
+        t_term = np.zeros(C, dtype=bool)
+        for i, chain in enumerate(bucket):
+            if irregular[i]:
+                kats[chain] = k_a_from_hl(chain, short=short, small=small)
+            elif null[i]:
+                kats[chain] = (None, None, None)
+            else:
+                m = mask[i]
+                kats[chain] = (k[i, m], a[i, m], t_term[m])
+    return kats
 
 
 def ensure_cse(a_i, b, cse):
-    bkey = EXP_EXPR.format(a=a_i)
-    if bkey not in cse:
+    """Ensures that the exponent coefficient a_i has a common sub-expression.
+    The cse dict is keyed by the coefficients themselves, since 17 digits
+    round-trip doubles, so that the exponent strings are formatted only once.
+    Returns the last sub-expression number and the one for a_i.
+    """
+    b_i = cse.get(a_i, None)
+    if b_i is None:
         b += 1
-        cse[bkey] = b
-    return b
+        cse[a_i] = b_i = b
+    return b, b_i
 
-def b_from_a(cse, a_i):
-    bkey = EXP_EXPR.format(a=a_i)
-    return cse[bkey]
 
-
-def chainexpr(chain, cse, b, bt, short=1e-16, small=1e-16):
+def chainterms(chain, cse, b, bt, short=1e-16, small=1e-16, kat=None):
+    """Returns the terms that a chain contributes to its end nuclide, as a list
+    of (k, b, t_term) tuples, where b is the number of the common exponential
+    sub-expression or None for constant terms. Terms that are zero are dropped.
+    """
     child = chain[-1]
     if len(chain) == 1:
-        a_i = -1.0 / half_life(child, False)
-        b = ensure_cse(a_i, b, cse)
-        terms = B_EXPR.format(b=b_from_a(cse, a_i))
-    else:
-        k, a, t_term = k_a_from_hl(chain, short=short, small=small)
-        if k is None:
-            return None, b, bt
-        terms = []
-        for k_i, a_i, t_term_i in zip(k, a, t_term):
-            if k_i == 1.0 and a_i == 0.0:
-                term = str(1.0 - bt)  # a slight optimization
-                bt = 1
-            elif a_i == 0.0:
-                if not np.isnan(k_i):
-                    if bt < 1:
-                        if k_i + bt < 1:
-                            term = '{0:.17e}'.format(k_i)  # another slight optimization
-                            bt += k_i
-                        else:
-                            term = '{0:.17e}'.format(1.0 - bt)
-                            bt = 1.0
-                    else:
-                        term = '0'
-                else:
-                    term = '0'
+        a_i = -LN2 / half_life(child, False)
+        b, b_i = ensure_cse(a_i, b, cse)
+        return [(1.0, b_i, False)], b, bt
+    k, a, t_term = k_a_from_hl(chain, short=short, small=small) \
+                   if kat is None else kat
+    if k is None:
+        return None, b, bt
+    terms = []
+    for k_i, a_i, t_term_i in zip(k, a, t_term):
+        if k_i == 1.0 and a_i == 0.0:
+            term = (1.0 - bt, None)  # a slight optimization
+            bt = 1
+        elif a_i == 0.0:
+            if np.isnan(k_i) or bt >= 1:
+                continue
+            elif k_i + bt < 1:
+                term = (k_i, None)  # another slight optimization
+                bt += k_i
             else:
-                b = ensure_cse(a_i, b, cse)
-                term = kbexpr(k_i, b_from_a(cse, a_i))
-            # multiply by t if needed
-            if t_term_i:
-                term += '*t'
-            terms.append(term)
-        terms = ' + '.join(terms)
-    return CHAIN_EXPR.format(terms), b, bt
-
-
-def gencase(nuc, idx, b, short=1e-16, small=1e-16, sf=False, debug=False):
-    case = ['}} case {0}: {{'.format(nuc)]
+                term = (1.0 - bt, None)
+                bt = 1.0
+        else:
+            b, b_i = ensure_cse(a_i, b, cse)
+            term = (k_i, b_i)
+        terms.append(term + (t_term_i,))
+    return terms, b, bt
+
+
+def genterms(nuc, idx, short=1e-16, small=1e-16, sf=False, debug=False,
+             min_branch=0.0):
+    """Generates the decay terms of a single nuclide. Returns comments, the
+    exponent coefficients, and the term coefficients, exponent indices, and
+    output indices.
+    """
+    comments = [nucname.name(nuc)]
     dc = decay_const(nuc, False)
     if dc == 0.0:
-        # stable nuclide
-        case.append(CHAIN_STMT.format(idx[nuc], 'it->second'))
-    else:
-        chains = genchains([(nuc,)], sf=sf)
-        print('{} has {} chains'.format(nucname.name(nuc), len(set(chains))))
-        cse = {}  # common sub-expression exponents to elimnate
-        bt = 0
-        for c in chains:
-            if c[-1] not in idx:
-                continue
-            cexpr, b, bt = chainexpr(c, cse, b, bt, short=short, small=small)
-            if cexpr is None:
-                continue
-            if debug:
-                case.append('  // ' + ' -> '.join(map(nucname.name, c)))
-            case.append(CHAIN_STMT.format(idx[c[-1]], cexpr))
-        bstmts = ['  ' + B_STMT.format(exp=exp, b=bval) for exp, bval in \
-                  sorted(cse.items(), key=lambda x: x[1])]
-        case = case[:1] + bstmts + case[1:]
-    case.append(BREAK)
-    return case, b
+        # stable nuclide, handled by decay() directly
+        return comments, [], [], [], []
+    chains = genchaingammas(nuc, sf=sf, min_branch=min_branch)
+    print('{} has {} chains'.format(nucname.name(nuc), len(chains)))
+    gammas = {c: g for c, g in chains if c[-1] in idx}
+    chains = list(gammas)
+    kats = k_a_from_hl_batch(chains, short=short, small=small, gammas=gammas)
+    cse = {}  # common sub-expression exponents to elimnate
+    b = -1
+    bt = 0
+    # Terms for the same output nuclide and exponential are summed across
+    # all chains, so that each output gets one term per exponential.
+    rows = {}
+    for c in chains:
+        terms, b, bt = chainterms(c, cse, b, bt, short=short, small=small,
+                                  kat=kats.get(c))
+        if terms is None:
+            continue
+        if debug:
+            comments.append(' -> '.join(map(nucname.name, c)))
+        row = rows.setdefault(idx[c[-1]], {})
+        for k_i, b_i, t_term_i in terms:
+            # k_filter() always removes the terms that are multiplied by t
+            assert not t_term_i
+            if b_i is None:
+                # constant terms are the zero exponential
+                b, b_i = ensure_cse(0.0, b, cse)
+            row[b_i] = row.get(b_i, 0.0) + k_i
+    A = [a for a, bval in sorted(cse.items(), key=lambda x: x[1])]
+    K, B, I = [], [], []
+    for i, row in rows.items():
+        for b_i, k_i in row.items():
+            K.append(k_i)
+            B.append(b_i)
+            I.append(i)
+    return comments, A, K, B, I
 
 
 def elems(nucs):
     return sorted(set(map(nucname.znum, nucs)))
 
 
-def gencases(nucs, debug=False):
-    switches = []
-    for i in elems(nucs):
-        c = ['case {0}:'.format(i),
-             '  decay_{0}(t, it, outcomp, out);'.format(nucname.name(i).lower()),
-             '  break;']
-        switches.append('\n'.join(c))
-    return '\n'.join(switches)
-
-
-def genelemfuncs(nucs, short=1e-16, small=1e-16, sf=False, debug=False,):
+def genelemterms(z, nucs, idx, short=1e-16, small=1e-16, sf=False, debug=False,
+                 min_branch=0.0):
+    """Generates the decay terms for all nuclides of a single element."""
+    return {nuc: genterms(nuc, idx, short=short, small=small, sf=sf, debug=debug,
+                          min_branch=min_branch)
+            for nuc in nucs if nucname.znum(nuc) == z}
+
+
+def minorterms(K, I):
+    """Picks the term coefficients that may be stored as floats. These must be
+    small and not subnormal as floats, and the total rounding error of the
+    picked terms is kept within MINOR_ERR, smallest terms first. Terms for the
+    same output nuclide may cancel, so the rounding error of each output is
+    added back into its largest double term, keeping one if all of its terms
+    are minor. This keeps the sum of its coefficients, and so its value at
+    t = 0, unchanged. Returns the adjusted
+    coefficients and which of them are minor.
+    """
+    minor = [False] * len(K)
+    err = 0.0
+    for n in sorted(range(len(K)), key=lambda n: abs(K[n])):
+        k = K[n]
+        if abs(k) >= MINOR_K:
+            break
+        elif k != 0.0 and abs(k) < FLT_TINY:
+            continue
+        err += abs(float(np.float32(k)) - k)
+        if err > MINOR_ERR:
+            break
+        minor[n] = True
+    K = list(K)
+    rows = {}
+    for n, i in enumerate(I):
+        rows.setdefault(i, []).append(n)
+    for row in rows.values():
+        major = [n for n in row if not minor[n]]
+        if len(major) == 0:
+            n = max(row, key=lambda n: abs(K[n]))
+            minor[n] = False
+            major.append(n)
+        resid = math.fsum([K[n] - float(np.float32(K[n])) for n in row if minor[n]])
+        n = max(major, key=lambda n: abs(K[n]))
+        K[n] += resid
+    return K, minor
+
+
+def tablestmt(type, name, blocks, fmt='{0}', qualifier='static const'):
+    """Renders an array from blocks of (comments, values)."""
+    n = 0
+    lines = []
+    for comments, values in blocks:
+        if len(values) == 0:
+            continue
+        n += len(values)
+        lines += ['  // ' + comment for comment in comments]
+        values = ', '.join([fmt.format(v) for v in values]) + ','
+        lines.append(textwrap.fill(values, width=78, initial_indent='  ',
+                                   subsequent_indent='  ', break_long_words=False,
+                                   break_on_hyphens=False))
+    if n == 0:
+        # C++ does not allow empty arrays, this entry is never indexed
+        n = 1
+        lines.append('  0,')
+    return '{0} {1} {2}[{3}] = {{\n{4}\n}};'.format(qualifier, type, name, n,
+                                                   '\n'.join(lines))
+
+
+def gentables(nucs, short=1e-16, small=1e-16, sf=False, debug=False, jobs=None,
+              min_branch=0.0):
+    """Generates the flat decay tables for the nuclides, in order. Elements are
+    independent of each other, so they are generated in parallel over jobs
+    processes (default is the number of CPUs). Each process has its own data
+    caches. Returns the rendered tables and the largest number of exponentials
+    that any one nuclide uses.
+    """
     idx = dict(zip(nucs, range(len(nucs))))
-    cases = {i: [-1, []] for i in elems(nucs)}
+    gen = partial(genelemterms, nucs=nucs, idx=idx, short=short, small=small,
+                  sf=sf, debug=debug, min_branch=min_branch)
+    if jobs == 1:
+        results = list(map(gen, elems(nucs)))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(gen, elems(nucs)))
+    terms = {}
+    for result in results:
+        terms.update(result)
+    stable = [decay_const(nuc, False) == 0.0 for nuc in nucs]
+    a_offset, term_offset, minor_offset = [0], [0], [0]
+    As, Ks, Bs, Is = [], [], [], []
+    Ks_minor, Bs_minor, Is_minor = [], [], []
     for nuc in nucs:
-        z = nucname.znum(nuc)
-        case, cases[z][0] = gencase(nuc, idx, cases[z][0], short=short, sf=sf,
-                                    debug=debug, small=small)
-        cases[z][1] += case
-    funcs = []
-    for i, (b, kases) in cases.items():
-        kases[0] = kases[0][2:]
-        ctx = dict(nucs=nucs, elem=nucname.name(i), cases='\n'.join(kases))
-        funcs.append(ELEM_FUNC.render(ctx))
-    return "\n\n".join(funcs)
+        comments, A, K, B, I = terms[nuc]
+        K, minor = minorterms(K, I)
+        K_minor = np.array([k for k, m in zip(K, minor) if m], dtype=np.float32)
+        err = np.abs(K_minor - np.array([k for k, m in zip(K, minor) if m])).sum()
+        assert err <= MINOR_ERR
+        a_offset.append(a_offset[-1] + len(A))
+        term_offset.append(term_offset[-1] + minor.count(False))
+        minor_offset.append(minor_offset[-1] + minor.count(True))
+        As.append((comments[:1], A))
+        Ks.append((comments, [k for k, m in zip(K, minor) if not m]))
+        Bs.append((comments[:1], [b for b, m in zip(B, minor) if not m]))
+        Is.append((comments[:1], [i for i, m in zip(I, minor) if not m]))
+        Ks_minor.append((comments[:1], K_minor))
+        Bs_minor.append((comments[:1], [b for b, m in zip(B, minor) if m]))
+        Is_minor.append((comments[:1], [i for i, m in zip(I, minor) if m]))
+    tables = [tablestmt('bool', 'STABLE', [([], stable)], '{0:d}',
+                        'static constexpr'),
+              tablestmt('int', 'A_OFFSET', [([], a_offset)]),
+              tablestmt('int', 'TERM_OFFSET', [([], term_offset)]),
+              tablestmt('int', 'MINOR_OFFSET', [([], minor_offset)]),
+              tablestmt('double', 'A', As, '{0:.17e}'),
+              tablestmt('double', 'K', Ks, '{0:.17e}'),
+              tablestmt('int', 'B', Bs),
+              tablestmt('int', 'I', Is),
+              tablestmt('float', 'K_MINOR', Ks_minor, '{0:.8e}f'),
+              tablestmt('int', 'B_MINOR', Bs_minor),
+              tablestmt('int', 'I_MINOR', Is_minor)]
+    max_exps = max([1] + [len(A) for _, A in As])
+    return '\n\n'.join(tables), max_exps
 
 
 def load_default_nucs():
+    # read the table once and filter in memory, rather than scanning it
+    # once per query
     with tb.open_file(nuc_data) as f:
-        ll = f.root.decay.level_list
-        stable = ll.read_where('(nuc_id%10000 == 0) & (nuc_id != 0)')
-        metastable = ll.read_where('metastable > 0')
-    nucs = set(int(nuc) for nuc in stable['nuc_id'])
-    nucs |= set(int(nuc) for nuc in metastable['nuc_id'])
+        ll = f.root.decay.level_list.read()
+    nuc_id = ll['nuc_id']
+    stable = nuc_id[(nuc_id % 10000 == 0) & (nuc_id != 0)]
+    metastable = nuc_id[ll['metastable'] > 0]
+    nucs = set(stable.tolist())
+    nucs |= set(metastable.tolist())
     nucs = sorted(nuc for nuc in nucs if not np.isnan(decay_const(nuc, False)))
     return nucs
 
@@ -482,10 +825,42 @@ def write_if_diff(filename, contents):
         f.write(contents)
 
 
+def cache_key(nucs, **kwargs):
+    """Returns a hash of everything that the generated files depend on: the
+    nuclides, the generation options, the nuclear data, and this generator.
+    """
+    stat = os.stat(nuc_data)
+    with io.open(__file__, 'rb') as f:
+        gen = f.read()
+    h = hashlib.sha256()
+    h.update(repr(list(nucs)).encode())
+    h.update(repr(sorted(kwargs.items())).encode())
+    h.update(repr((pyne_version, stat.st_size, stat.st_mtime)).encode())
+    h.update(gen)
+    return h.hexdigest()
+
+
 def build(hdr='decay.h', src='decay.cpp', nucs=None, short=1e-16, small=1e-16,
-          sf=False, dummy=False, debug=False):
+          sf=False, dummy=False, debug=False, jobs=None, cache=False,
+          min_branch=0.0):
     nucs = load_default_nucs() if nucs is None else list(map(nucname.id, nucs))
-    h, s = genfiles(nucs, short=short, small=small, sf=sf, dummy=dummy, debug=debug)
+    if cache:
+        base = os.path.join(CACHE_DIR, cache_key(nucs, short=short, small=small,
+                                                 sf=sf, dummy=dummy, debug=debug,
+                                                 min_branch=min_branch))
+    if cache and os.path.isfile(base + '.h') and os.path.isfile(base + '.cpp'):
+        print('using cached decay files ' + base + '.{h,cpp}')
+        with io.open(base + '.h', 'r') as f:
+            h = f.read()
+        with io.open(base + '.cpp', 'r') as f:
+            s = f.read()
+    else:
+        h, s = genfiles(nucs, short=short, small=small, sf=sf, dummy=dummy,
+                        debug=debug, jobs=jobs, min_branch=min_branch)
+        if cache:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            write_if_diff(base + '.h', h)
+            write_if_diff(base + '.cpp', s)
     write_if_diff(hdr, h)
     write_if_diff(src, s)
 
@@ -522,6 +897,10 @@ def main():
                         help='Fraction of k coeficient for which nuclide term is'
                              'filtered from a decay chain, default 1e-16.'
                              'Set to -1 (or other <= 0.0 value) to disable')
+    parser.add_argument('--min-branch', default=0.0, type=float, dest='min_branch',
+                        help='Product of branch ratios at or below which a decay '
+                             'chain is pruned, default 0.0 (only impossible '
+                             'chains are pruned).')
     parser.add_argument('--short', '--filter-short', default=1e-16, type=float, dest='short',
                         help='Fraction of sum of all half-lives below which a '
                              'nuclide is filtered from a decay chain, default 1e-16.'
@@ -537,6 +916,14 @@ def main():
                        help='Does not build the source code.')
     parser.add_argument('--debug', dest='debug', default=False, action='store_true',
                         help='Adds more information to the output.')
+    parser.add_argument('--cache', dest='cache', default=False, action='store_true',
+                        help='Reuses the files cached in ' + CACHE_DIR + ' for '
+                             'the same nuclides, options, nuclear data, pyne '
+                             'version, and generator. Changes to the pyne data '
+                             'code itself are not detected.')
+    parser.add_argument('-j', '--jobs', dest='jobs', default=None, type=int,
+                        help='Number of processes to generate the element '
+                             'functions with, default is the number of CPUs.')
     parser.add_argument("--gcc-asm", "--gnu-asm", action='store_true', default=False, dest='gnu_asm',
                         help="Creates GCC assembly, so that users don't have to go "
                              "through full compile.")
@@ -547,7 +934,8 @@ def main():
     if ns.build:
         try:
             build(hdr=ns.hdr, src=ns.src, nucs=ns.nucs, short=ns.short, sf=ns.sf,
-                  dummy=ns.dummy, debug=ns.debug, small=ns.small)
+                  dummy=ns.dummy, debug=ns.debug, small=ns.small, jobs=ns.jobs,
+                  cache=ns.cache, min_branch=ns.min_branch)
         except Exception:
             type, value, tb = sys.exc_info()
             traceback.print_exc()
@@ -39,7 +39,7 @@ namespace pyne
 
   #ifdef PYNE_IS_AMALGAMATED
   namespace decayers {
-    extern comp_map decay(comp_map, double);
+    extern comp_map decay(const comp_map&, double);
   }  // namespace decayers
   #endif
 
@@ -2,8 +2,11 @@
 from __future__ import print_function, unicode_literals
 import os
 import sys
+import re
 import json
+import math
 import warnings
+from contextlib import contextmanager
 if sys.version_info[0] >= 3:
     from urllib.request import urlretrieve
     from functools import lru_cache
@@ -17,7 +20,8 @@ from nose.tools import assert_equal, assert_not_equal, assert_raises, raises, \
 
 import numpy as np
 import tables as tb
-from numpy.testing import assert_array_equal, assert_array_almost_equal
+from numpy.testing import assert_array_equal, assert_array_almost_equal, \
+    assert_allclose
 
 from pyne.utils import QAWarning
 warnings.simplefilter("ignore", QAWarning)
@@ -187,5 +191,385 @@ def test_benchmark():
         yield check_materr, row
 
 
+#
+# decaygen coefficient tests
+#
+
+# half-lives and branch ratios of made up chains
+K_A_CASES = [
+    # stable and unstable ends
+    ([10.0, np.inf], [0.5]),
+    ([10.0, 3.0], [1.0]),
+    ([10.0, 3.0, np.inf], [1.0, 0.3]),
+    ([10.0, 3.0, 7.0], [0.2, 1.0]),
+    ([10.0, 3.0, 7.0, np.inf], [1.0, 0.5, 0.3]),
+    ([10.0, 3.0, 7.0, 1e3, 2.0], [0.2, 1.0, 1.0, 0.7]),
+    ([1e-3, 3e4, 7.0, 2.0, 5e5, np.inf], [1.0, 1.0, 0.9, 1.0, 1.0]),
+    # almost stable
+    ([3e17, 10.0], [1.0]),
+    ([1e200, 10.0, np.inf], [1.0, 1.0]),
+    ([1e200, 10.0, 3.0], [1.0, 1.0]),
+    ([10.0, 1e200, 3.0], [1.0, 1.0]),
+    ([1e200, 10.0, 3.0, np.inf], [1.0, 1.0, 1.0]),
+    ([1e200, 10.0, 3.0, 5.0], [1.0, 1.0, 1.0]),
+    ([3e17, 10.0, 3.0, 5.0], [1.0, 1.0, 1.0]),
+    ([10.0, 3e17, 3.0, np.inf], [1.0, 1.0, 1.0]),
+    # degenerate
+    ([10.0, 10.0], [1.0]),
+    ([10.0, 10.0, np.inf], [1.0, 1.0]),
+    ([10.0, 3.0, 10.0], [1.0, 1.0]),
+    ([10.0, 3.0, 10.0, np.inf], [1.0, 1.0, 1.0]),
+    ([5.0, 10.0, 10.0, 2.0], [1.0, 1.0, 1.0]),
+    # unknown
+    ([np.nan, 3.0], [1.0]),
+    ([10.0, np.nan, np.inf], [1.0, 1.0]),
+    ([10.0, np.nan, 3.0, np.inf], [1.0, 1.0, 1.0]),
+    # impossible
+    ([10.0, 3.0], [0.0]),
+    ([10.0, 3.0, 7.0, np.inf], [1.0, 0.0, 1.0]),
+    ]
+
+
+def random_k_a_cases(n, lengths, seed=42):
+    """Makes up n chains with random half-lives and branch ratios."""
+    rs = np.random.RandomState(seed)
+    cases = []
+    for _ in range(n):
+        C = rs.choice(lengths)
+        hls = 10**rs.uniform(-3, 10, C)
+        if rs.uniform() < 0.3:
+            hls[-1] = np.inf
+        cases.append((list(hls), list(rs.uniform(0, 1, C - 1))))
+    return cases
+
+
+@contextmanager
+def fake_decay_data(hl, br, fpy=None):
+    """Points the decaygen data lookups at made up half-lives, keyed by
+    nuclide, and branch ratios and fission product yields, keyed by
+    (parent, child).
+    """
+    fpy = {} if fpy is None else fpy
+    names = ['half_life', 'decay_const', 'branch_ratio', 'decay_children',
+             'fpyield']
+    orig = [getattr(decaygen, name) for name in names]
+    decaygen.half_life = lambda nuc, use_metastable=True: hl[nuc]
+    decaygen.decay_const = lambda nuc, use_metastable=True: np.log(2) / hl[nuc]
+    decaygen.branch_ratio = lambda p, c, use_metastable=True: br.get((p, c), 0.0)
+    decaygen.decay_children = lambda nuc, use_metastable=True: \
+        set([c for p, c in list(br) + list(fpy) if p == nuc])
+    decaygen.fpyield = lambda p, c, source=0, get_errors=False: \
+        fpy.get((p, c), 0.0)
+    try:
+        yield
+    finally:
+        for name, f in zip(names, orig):
+            setattr(decaygen, name, f)
+
+
+@contextmanager
+def fake_chain_data(cases):
+    """Points the decaygen data lookups at the made up chains. Nuclide i of
+    case j is numbered 100*j + i. Yields the chains.
+    """
+    hl = {}
+    br = {}
+    chains = []
+    for j, (hls, brs) in enumerate(cases):
+        chain = tuple(range(100*j, 100*j + len(hls)))
+        hl.update(zip(chain, hls))
+        br.update(zip(zip(chain[:-1], chain[1:]), brs))
+        chains.append(chain)
+    with fake_decay_data(hl, br):
+        yield chains
+
+
+def check_k_a(chain, exp, obs):
+    if exp[0] is None:
+        assert_equal(obs, (None, None, None))
+        return
+    assert_allclose(obs[0], exp[0], rtol=1e-10)
+    assert_allclose(obs[1], exp[1], rtol=1e-15)
+    assert_array_equal(obs[2], exp[2])
+
+
+def k_from_hl_jits():
+    """The JIT compiled k kernel, if numba is available, and the NumPy
+    fallback, which is used when it is None.
+    """
+    jits = [None]
+    if decaygen.k_from_hl_jit is not None:
+        jits.append(decaygen.k_from_hl_jit)
+    return jits
+
+
+def test_k_a_from_hl_batch():
+    cases = K_A_CASES + random_k_a_cases(200, [2, 3, 4, 5, 6])
+    orig = decaygen.k_from_hl_jit
+    for jit in k_from_hl_jits():
+        decaygen.k_from_hl_jit = jit
+        try:
+            with fake_chain_data(cases) as chains:
+                kats = decaygen.k_a_from_hl_batch(chains)
+                exps = [decaygen.k_a_from_hl(chain) for chain in chains]
+        finally:
+            decaygen.k_from_hl_jit = orig
+        for chain, exp in zip(chains, exps):
+            yield check_k_a, chain, exp, kats[chain]
+
+
+def check_k_from_hl_short(hl, gamma, ends_stable, k_from_hl):
+    obs = decaygen.k_from_hl_short(hl, gamma, ends_stable)
+    exp = k_from_hl(hl, gamma, ends_stable)
+    assert_allclose(obs, exp, rtol=1e-10)
+    # the closed forms also decide which rows are almost stable
+    assert_array_equal(decaygen.almost_stable_mask(hl, obs),
+                       decaygen.almost_stable_mask(hl, exp))
+
+
+def k_from_hl_batch(hl, gamma, ends_stable):
+    """The general NumPy forms of the k values."""
+    outerdiff = hl[:, np.newaxis, :] - hl[:, :, np.newaxis]
+    outerzeros = (outerdiff == 0.0)
+    k = np.empty(hl.shape, dtype=float)
+    for rows, k_from_hl in [(ends_stable, decaygen.k_from_hl_stable_batch),
+                            (~ends_stable, decaygen.k_from_hl_unstable_batch)]:
+        if rows.any():
+            k[rows] = k_from_hl(hl[rows], gamma[rows], outerdiff[rows],
+                                outerzeros[rows])
+    return k
+
+
+def test_k_from_hl_short():
+    # only chains that are not degenerate and have known half-lives are
+    # computed with the closed forms
+    k_from_hls = [k_from_hl_batch, decaygen.k_from_hl_loops]
+    if decaygen.k_from_hl_jit is not None:
+        k_from_hls.append(decaygen.k_from_hl_jit)
+    for C in [2, 3]:
+        cases = [(hls, brs) for hls, brs in K_A_CASES if len(hls) == C and
+                 not np.isnan(hls).any() and len(set(hls)) == C]
+        cases += random_k_a_cases(100, [C])
+        hl = np.array([hls for hls, _ in cases])
+        gamma = np.array([np.prod(brs) for _, brs in cases])
+        ends_stable = np.isinf(hl[:, -1])
+        for k_from_hl in k_from_hls:
+            yield check_k_from_hl_short, hl, gamma, ends_stable, k_from_hl
+
+
+# term coefficients and output indices for minorterms()
+MINOR_CASES = [
+    # cancelling terms for one output
+    ([1.0, -0.5, -0.5 + 3e-7, 3.3e-7, -6.3e-7], [0, 0, 0, 0, 0]),
+    # every term of an output is minor
+    ([1.0, 1.1e-7, -1.3e-7, 2.3e-8], [0, 1, 1, 1]),
+    # a single minor term
+    ([1.0, 3.1e-7], [0, 1]),
+    # subnormal as floats
+    ([1.0, 1e-40, -3e-39, 1e-7 + 1e-40], [0, 0, 1, 1]),
+    # more rounding error than the budget
+    ([1.0] + [9.1e-7 + 1e-9*n for n in range(200)], [0] + [1 + n % 3 for n in range(200)]),
+    ]
+
+
+def check_minorterms(K, I):
+    adjusted, minor = decaygen.minorterms(K, I)
+    assert_equal(len(adjusted), len(K))
+    assert_equal(len(minor), len(K))
+    stored = [float(np.float32(k)) if m else k for k, m in zip(adjusted, minor)]
+    # the coefficients of each output still sum to the same value
+    for i in set(I):
+        row = [n for n in range(len(K)) if I[n] == i]
+        exp = math.fsum([K[n] for n in row])
+        obs = math.fsum([stored[n] for n in row])
+        assert_less(abs(obs - exp), 2 * np.spacing(max([abs(K[n]) for n in row])))
+    # the rounding error of the minor terms is within budget
+    err = math.fsum([abs(float(np.float32(k)) - k) for k, m in zip(K, minor) if m])
+    assert_true(err <= decaygen.MINOR_ERR)
+    for k, m in zip(K, minor):
+        if m:
+            # only small terms that are not subnormal as floats are picked
+            assert_less(abs(k), decaygen.MINOR_K)
+            assert_true(k == 0.0 or abs(k) >= np.finfo(np.float32).tiny)
+
+
+def test_minorterms():
+    for K, I in MINOR_CASES:
+        yield check_minorterms, K, I
+
+
+def test_minorterms_budget():
+    K, I = MINOR_CASES[-1]
+    _, minor = decaygen.minorterms(K, I)
+    # the budget runs out before all of the small terms are picked
+    assert_true(0 < sum(minor) < len(K) - 1)
+
+
+# a made up decay network for chain generation, keyed by small numbers
+CHAIN_HL = {1: 10.0, 2: 5.0, 3: 4.0, 4: 3.0, 5: 2.0, 6: 1.0, 7: np.inf, 8: 6.0}
+CHAIN_BR = {
+    (1, 2): 0.7, (1, 3): 0.3,
+    (2, 4): 0.0,  # zero branch ratio
+    (2, 5): np.nan,  # unknown branch ratio
+    (3, 6): 1.0,
+    (6, 3): 0.5, (6, 7): 0.5,  # cycle
+    (4, 7): 1.0, (5, 7): 1.0, (8, 7): 1.0,
+    }
+CHAIN_FPY = {(1, 8): 0.1}  # fission yield child
+
+
+def recursive_genchains(chains, sf=False):
+    """The original, recursive, genchains()."""
+    chain = chains[-1]
+    children = decaygen.decay_children(chain[-1])
+    if not sf:
+        children = {c for c in children if (0.0 == decaygen.fpyield(chain[-1], c))
+                    and (c not in chain)}
+    if decaygen.decay_const(chain[-1]) != 0:
+        for child in children:
+            if child not in chain:
+                chains.append(chain + (child,))
+                chains = recursive_genchains(chains, sf=sf)
+    return chains
+
+
+def check_chains(obs, exp):
+    assert_equal(obs, exp)
+
+
+def test_genchains():
+    for chains in [[(1,)], [(6, 1)], [(3,)]]:
+        for sf in [False, True]:
+            with fake_decay_data(CHAIN_HL, CHAIN_BR, CHAIN_FPY):
+                obs = decaygen.genchains(list(chains), sf=sf)
+                exp = recursive_genchains(list(chains), sf=sf)
+            yield check_chains, obs, exp
+
+
+def check_min_branch(obs, exp):
+    assert_equal([c for c, _ in obs], [c for c, _ in exp])
+    assert_allclose([g for _, g in obs], [g for _, g in exp])
+
+
+def test_genchaingammas_min_branch():
+    with fake_decay_data(CHAIN_HL, CHAIN_BR, CHAIN_FPY):
+        chaingammas = decaygen.genchaingammas(1, min_branch=-np.inf)
+        gammas = [decaygen.chain_gamma(c) for c, _ in chaingammas]
+        prunes = [(m, decaygen.genchaingammas(1, min_branch=m))
+                  for m in [0.0, 0.15, 0.3, 0.35, 0.7]]
+    assert_allclose([g for _, g in chaingammas], gammas)
+    gammas = dict(chaingammas)
+    for m, obs in prunes:
+        # chains with a gamma at or below min_branch are dropped, along with
+        # their extensions
+        exp = [(c, g) for c, g in chaingammas
+               if not any([gammas[c[:n]] <= m for n in range(1, len(c) + 1)])]
+        yield check_min_branch, obs, exp
+
+
+#
+# decaygen table tests
+#
+
+# a made up decay network, with a small branch that gets float terms
+NET_HL = {
+    922380000: 1e10, 902340000: 1e3, 912340000: 50.0, 922340000: 1e5,
+    902300000: np.inf, 10030000: 3e3, 20030000: np.inf, 822060000: np.inf,
+    }
+NET_BR = {
+    (922380000, 902340000): 1.0 - 1e-8,
+    (922380000, 10030000): 1e-8,
+    (902340000, 912340000): 0.6,
+    (902340000, 922340000): 0.4,
+    (912340000, 922340000): 1.0,
+    (922340000, 902300000): 1.0,
+    (10030000, 20030000): 1.0,
+    }
+DECAY_TIMES = [0.0, 10.0, 1e4]
+
+
+def parse_tables(tables):
+    """Parses the rendered decay tables into arrays, keyed by name."""
+    arrays = {}
+    for m in re.finditer(r'(\w+)\[\d+\] = \{\n(.*?)\n\};', tables, re.S):
+        lines = [line for line in m.group(2).splitlines()
+                 if not line.strip().startswith('//')]
+        values = ' '.join(lines).replace('f,', ',').split(',')
+        arrays[m.group(1)] = np.array([float(v) for v in values if v.strip()])
+    return arrays
+
+
+def table_decay(arrays, j, t):
+    """Decays a unit of nuclide j with the tables, as decay() does."""
+    out = np.zeros(len(arrays['STABLE']))
+    if arrays['STABLE'][j]:
+        out[j] = 1.0
+        return out
+    A = arrays['A'][int(arrays['A_OFFSET'][j]):]
+    for k, b, i in [('K', 'B', 'I'), ('K_MINOR', 'B_MINOR', 'I_MINOR')]:
+        offset = 'TERM_OFFSET' if k == 'K' else 'MINOR_OFFSET'
+        s = slice(int(arrays[offset][j]), int(arrays[offset][j + 1]))
+        for k_i, b_i, i_i in zip(arrays[k][s], arrays[b][s], arrays[i][s]):
+            out[int(i_i)] += k_i * np.exp(A[int(b_i)] * t)
+    return out
+
+
+def chain_decay(nuc, nucs, t):
+    """Decays a unit of a nuclide by summing the k_a_from_hl() terms of all of
+    its chains.
+    """
+    out = np.zeros(len(nucs))
+    if decaygen.decay_const(nuc) == 0.0:
+        out[nucs.index(nuc)] = 1.0
+        return out
+    for chain, _ in decaygen.genchaingammas(nuc):
+        i = nucs.index(chain[-1])
+        if len(chain) == 1:
+            out[i] += np.exp(-decaygen.decay_const(nuc) * t)
+            continue
+        k, a, _ = decaygen.k_a_from_hl(chain)
+        if k is not None:
+            out[i] += (k * np.exp(a * t)).sum()
+    return out
+
+
+def check_offsets(offsets):
+    assert_equal(offsets[0], 0)
+    assert_true((np.diff(offsets) >= 0).all())
+
+
+def check_stable_ranges(arrays, j):
+    for offset in ['A_OFFSET', 'TERM_OFFSET', 'MINOR_OFFSET']:
+        assert_equal(arrays[offset][j], arrays[offset][j + 1])
+
+
+def check_table_decay(arrays, j, t, exp):
+    obs = table_decay(arrays, j, t)
+    # float terms may be off by up to MINOR_ERR in total, except at t = 0
+    atol = 1e-15 if t == 0.0 else decaygen.MINOR_ERR
+    assert_allclose(obs, exp, rtol=1e-10, atol=atol)
+
+
+def test_gentables():
+    nucs = sorted(NET_HL)
+    with fake_decay_data(NET_HL, NET_BR):
+        tables, max_exps = decaygen.gentables(nucs, jobs=1)
+        exps = [[chain_decay(nuc, nucs, t) for t in DECAY_TIMES] for nuc in nucs]
+        stable = [decaygen.decay_const(nuc) == 0.0 for nuc in nucs]
+    arrays = parse_tables(tables)
+    assert_array_equal(arrays['STABLE'], stable)
+    # the small branch is stored as float terms
+    assert_true(arrays['MINOR_OFFSET'][-1] > 0)
+    assert_equal(max_exps, np.diff(arrays['A_OFFSET']).max())
+    for offset in ['A_OFFSET', 'TERM_OFFSET', 'MINOR_OFFSET']:
+        assert_equal(len(arrays[offset]), len(nucs) + 1)
+        yield check_offsets, arrays[offset]
+    for j in range(len(nucs)):
+        if stable[j]:
+            yield check_stable_ranges, arrays, j
+        for t, exp in zip(DECAY_TIMES, exps[j]):
+            yield check_table_decay, arrays, j, t, exp
+
+
 if __name__ == "__main__":
     nose.runmodule()